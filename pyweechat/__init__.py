@@ -1,5 +1,10 @@
 from .message import WeeChatMessage
 from .exceptions import WeeChatUnknownCommandException
 from .socket import WeeChatSocket
-from .buffer import WeeChatBuffer
-from .client import WeeChatClient
\ No newline at end of file
+from .hdata import WeeChatHdataQuery
+from .cache import WeeChatCache
+from .colors import strip_colors, decode_colors
+from .buffer import WeeChatBuffer, WeeChatLine
+from .client import WeeChatClient
+from .proxy import WeeChatProxy
+from .capture import WeeChatRecorder, WeeChatReplay, WeeChatReplaySocket
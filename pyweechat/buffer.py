@@ -1,4 +1,69 @@
 from .socket import WeeChatSocket
+from .hdata import WeeChatHdataQuery
+from .colors import strip_colors, strip_colors_bulk, decode_colors
+
+_LINE_KEYS = ("message", "displayed", "highlight", "date")
+_BUFFER = WeeChatHdataQuery.prepare("buffer", "", ("number", "name", "full_name", "short_name", "title", "active",
+                                                   "nicklist", "next_buffer"))
+_LINES = WeeChatHdataQuery.prepare("buffer", "lines", ("lines_count", "first_line"))
+_ALL_LINES = WeeChatHdataQuery.prepare("buffer", "lines/first_line(*)/data", _LINE_KEYS)
+_LINE = WeeChatHdataQuery.prepare("line", "", ("next_line",))
+_LINE_DATA = WeeChatHdataQuery.prepare("line", "data", _LINE_KEYS)
+
+
+def _hdata_pointer(pointer: str) -> str:
+    """
+    Format a pointer received from the relay for use in a hdata path
+    :param pointer: raw pointer or name of a hdata list (gui_buffers, ...)
+    :return: str
+    """
+    if not pointer.startswith("gui"):
+        return "0x" + pointer
+    return pointer
+
+
+class WeeChatLine(dict):
+    """
+    A single line of a buffer.
+    Behaves like a dict. The message is decoded on first access of text or spans and the result is kept.
+    """
+    __slots__ = ("_text", "_spans")
+
+    def __init__(self, *args, **kwargs):
+        super(WeeChatLine, self).__init__(*args, **kwargs)
+        self._text = None
+        self._spans = None
+
+    @property
+    def text(self) -> str:
+        """
+        :return: message without color and attribute codes
+        """
+        message = self["message"]
+        if self._text is None or self._text[0] is not message:
+            self._text = (message, strip_colors(message))
+        return self._text[1]
+
+    @property
+    def spans(self) -> list:
+        """
+        :return: message split into styled spans. See decode_colors
+        """
+        message = self["message"]
+        if self._spans is None or self._spans[0] is not message:
+            self._spans = (message, decode_colors(message))
+        return self._spans[1]
+
+    @staticmethod
+    def decode(lines: list) -> None:
+        """
+        Strip the color codes of many lines at once and keep the result for text
+        :param lines: list of WeeChatLine
+        """
+        lines = [line for line in lines if line._text is None or line._text[0] is not line["message"]]
+        messages = [line["message"] for line in lines]
+        for line, message, text in zip(lines, messages, strip_colors_bulk(messages)):
+            line._text = (message, text)
 
 
 class WeeChatBuffer:
@@ -25,16 +90,20 @@ class WeeChatBuffer:
             self.number = data.get("number", -1)
             self.lines = []
             self.nicklist = []
-            self.pointer = data.get("buffer")
+            self.pointer = data.get("buffer", data.get("__path", [None])[0])
+
+    @staticmethod
+    def _parse_line(line: dict) -> WeeChatLine:
+        return WeeChatLine({
+            "message": line["message"],
+            "displayed": line["displayed"] == b"\x01",
+            "highlight": line["highlight"] == b"\x01",
+            "date": line["date"]
+        })
 
     def add_line(self, line):
         if line:
-            self.lines.append({
-                "message": line["message"],
-                "displayed": line["displayed"] == b"\x01",
-                "highlight": line["highlight"] == b"\x01",
-                "date": line["date"]
-            })
+            self.lines.append(self._parse_line(line))
 
     def add_nick(self, nick):
         if nick and nick.get("visible") == b"\x01":
@@ -46,18 +115,57 @@ class WeeChatBuffer:
             })
 
     @staticmethod
-    def from_pointer(socket: WeeChatSocket, pointer_: str):
-        if not pointer_.startswith("gui"):
-            pointer = "0x" + pointer_
+    def iter_history(socket: WeeChatSocket, pointer: str, before: str = None, page_size: int = 100, lock=None):
+        """
+        Walk the lines of a buffer backwards, newest line first.
+        Lines are requested page_size at a time and are not stored in the buffer.
+        :param socket: socket to request the lines from
+        :param pointer: pointer of the buffer
+        :param before: pointer of a line. Only lines older than this line are returned. None to start at the newest line
+        :param page_size: number of lines requested per round trip
+        :param lock: lock to hold while requesting a page. None if the socket is not shared between threads
+        :return: generator of line dicts. The "pointer" key can be passed as before to resume
+        """
+        def fetch(query, pointer, count=None):
+            if lock is None:
+                return query.fetch(socket, pointer, count)
+            with lock:
+                return query.fetch(socket, pointer, count)
+
+        if before is None:
+            last_lines = WeeChatHdataQuery.prepare("buffer", "own_lines/last_line(-{})/data".format(page_size),
+                                                   _LINE_KEYS)
+            page = fetch(last_lines, _hdata_pointer(pointer))
         else:
-            pointer = pointer_
+            # the line given as start is part of the reply, so request one more
+            page = fetch(_LINE_DATA, "0x" + before, -(page_size + 1))
+
+        while page:
+            count = 0
+            for line in page:
+                line_pointer = line["__path"][-2]
+                if line_pointer == before:
+                    continue
+                count += 1
+                before = line_pointer
+                parsed = WeeChatBuffer._parse_line(line)
+                parsed["pointer"] = line_pointer
+                yield parsed
+
+            if count < page_size:
+                return
+            page = fetch(_LINE_DATA, "0x" + before, -(page_size + 1))
+
+    @staticmethod
+    def from_pointer(socket: WeeChatSocket, pointer_: str):
+        pointer = _hdata_pointer(pointer_)
 
         # read meta information
-        resp_buf = socket.send("hdata buffer:" + pointer).get_hdata_result()
-        if resp_buf is None:
+        resp_buf = _BUFFER.fetch(socket, pointer)
+        if not resp_buf:
             return None
+        resp_buf = resp_buf[0]
         buffer = WeeChatBuffer(resp_buf)
-        buffer.pointer = pointer_
 
         if resp_buf.get("nicklist") and resp_buf.get("nicklist") != 0:
             resp_nick = socket.send("nicklist " + pointer).get_hdata_result()
@@ -66,25 +174,23 @@ class WeeChatBuffer:
                     buffer.add_nick(nick)
 
         # read line count
-        resp_lc = socket.send("hdata buffer:{}/lines".format(pointer)).get_hdata_result()
-        if resp_lc is not None:
+        resp_lc = _LINES.fetch(socket, pointer)
+        if resp_lc:
+            resp_lc = resp_lc[0]
             line_count = resp_lc.get("lines_count")
             if line_count < 20:  # request all line data at once
-                resp_ld = socket.send("hdata buffer:{}/lines/first_line(*)/data").get_hdata_result()
-                if resp_ld:
-                    for line in resp_ld:
-                        buffer.add_line(line)
+                for line in _ALL_LINES.fetch(socket, pointer):
+                    buffer.add_line(line)
             else:  # request a single line at a time
                 last_id = resp_lc.get("first_line")
                 for i in range(line_count - 1):
-                    resp_ld = socket.send("hdata line:0x" + last_id + "/data").get_hdata_result()
-                    if resp_ld:
-                        buffer.add_line(resp_ld)
+                    for line in _LINE_DATA.fetch(socket, "0x" + last_id):
+                        buffer.add_line(line)
 
-                    resp_next = socket.send("hdata line:0x" + last_id).get_hdata_result()
+                    resp_next = _LINE.fetch(socket, "0x" + last_id)
                     if resp_next:
-                        if resp_next.get("next_line") is not None and resp_next.get("next_line") != "0":
-                            last_id = resp_next.get("next_line")
+                        if resp_next[0].get("next_line") is not None and resp_next[0].get("next_line") != "0":
+                            last_id = resp_next[0].get("next_line")
                         else:
                             break
                     else:
@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict
+from threading import Event, Lock, get_ident
+
+
+class WeeChatCache:
+    """
+    Size bounded LRU cache for replies of the weechat relay.
+    Keys are tuples whose first element is the kind of request (info, infolist, hdata), which allows
+    invalidating all entries of a kind at once.
+    Concurrent lookups of the same missing key share a single request. A lookup made by the thread which is
+    already fetching the key (e.g. from an event handler run while waiting for the reply) fetches on its own.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 60.0):
+        """
+        :param max_size: maximum number of cached replies
+        :param ttl: seconds a reply stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def get(self, key: tuple, fetch: callable, ttl: float = None):
+        """
+        Return the cached value of key or fetch and cache it
+        :param key: tuple of (kind, ...)
+        :param fetch: function returning the value if key is not cached. Exceptions are passed to the caller
+        :param ttl: seconds the fetched value stays valid. None to use the default
+        :return: cached or fetched value
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    inflight = self._inflight[key] = (Event(), {}, get_ident())
+                    generation = self._generation
+                    break
+                reentrant = inflight[2] == get_ident()
+            if reentrant:
+                # fetching this key ourselves further up the stack, waiting for it would never end
+                return fetch()
+            # another caller is already requesting this key
+            inflight[0].wait()
+            if "value" in inflight[1]:
+                return inflight[1]["value"]
+            # the other request failed, try ourselves
+
+        try:
+            value = fetch()
+            inflight[1]["value"] = value
+            self.put(key, value, generation, ttl)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight[0].set()
+
+    @property
+    def generation(self) -> int:
+        """
+        :return: number which changes whenever cached replies are invalidated
+        """
+        return self._generation
+
+    def peek(self, key: tuple):
+        """
+        Return the cached value of key without fetching it, for callers which request asynchronously
+        :param key: tuple of (kind, ...)
+        :return: cached value or None if key is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, value, generation: int = None, ttl: float = None) -> None:
+        """
+        Cache a value
+        :param key: tuple of (kind, ...)
+        :param value: value to cache
+        :param generation: generation at the time the value was requested. The value is dropped if replies were
+            invalidated since. None to always cache it
+        :param ttl: seconds the value stays valid. None to use the default
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:  # invalidated while fetching
+                return
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *kinds) -> None:
+        """
+        Drop cached replies
+        :param kinds: kinds of requests to drop (info, infolist, hdata). Drop everything if not given
+        """
+        with self._lock:
+            self._generation += 1
+            if not kinds:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] in kinds]:
+                del self._entries[key]
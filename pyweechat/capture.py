@@ -0,0 +1,162 @@
+import mmap
+import time
+import struct
+from .socket import WeeChatSocket
+
+# File layout: _MAGIC, followed by records of an 8 byte big endian timestamp (seconds since epoch, double)
+# and the raw message as received, which starts with its own length
+_MAGIC = b"PWCAP\x00\x00\x01"
+_TIMESTAMP = struct.Struct(">d")
+
+
+class WeeChatRecorder:
+    """
+    Appends received relay messages with their time of arrival to a capture file.
+
+    Usage:
+    >>> socket = WeeChatSocket(recorder=WeeChatRecorder("session.cap"))
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: capture file to append to. Created if it does not exist
+        """
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(_MAGIC)
+
+    def record(self, frame: bytes) -> None:
+        """
+        Append a single complete message. The file is flushed, so a killed process loses at most this record
+        :param frame: message including its length header
+        """
+        self.file.write(_TIMESTAMP.pack(time.time()) + frame)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class WeeChatReplay:
+    """
+    Reads a capture file written by WeeChatRecorder.
+
+    Usage:
+    >>> for timestamp, frame in WeeChatReplay("session.cap").frames():
+    ...     WeeChatMessage(frame)
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: capture file to read
+        """
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("not a capture file: " + path)
+
+    def frames(self):
+        """
+        Iterate over all recorded messages
+        :return: generator of tuple(float, bytes) with the time of arrival and the message
+        """
+        data = self.data
+        offset = len(_MAGIC)
+        end = len(data)
+        while offset + 12 <= end:
+            timestamp = _TIMESTAMP.unpack_from(data, offset)[0]
+            length = struct.unpack_from(">I", data, offset + 8)[0]
+            offset += 8
+            if offset + length > end:  # last record was cut off, e.g. the recording process was killed
+                return
+            yield timestamp, data[offset:offset + length]
+            offset += length
+
+    def close(self) -> None:
+        self.data.close()
+
+
+class _WeeChatReplayStream:
+    """
+    Stands in for the network socket of WeeChatReplaySocket.
+    Every recv returns the next recorded message, everything sent is discarded.
+    """
+
+    def __init__(self, replay: WeeChatReplay, realtime: bool):
+        self.frames = replay.frames()
+        self.realtime = realtime
+        self.finished = False
+        self._next = None
+        self._start = None
+
+    def recv(self, size: int) -> bytes:
+        if self._next is None:
+            self._next = next(self.frames, None)
+            if self._next is None:
+                self.finished = True
+                raise BlockingIOError()
+        timestamp, frame = self._next
+
+        if self.realtime:
+            if self._start is None:
+                self._start = (time.monotonic(), timestamp)
+            if time.monotonic() - self._start[0] < timestamp - self._start[1]:
+                raise BlockingIOError()
+        self._next = None
+        return frame
+
+    def send(self, data) -> int:
+        return len(data)
+
+    def sendall(self, data) -> None:
+        pass
+
+    def setblocking(self, flag) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class WeeChatReplaySocket(WeeChatSocket):
+    """
+    WeeChatSocket which receives the messages of a capture file instead of connecting to a relay server.
+    Requests are accepted but discarded, so a WeeChatClient replaying a session recorded from its start
+    receives the same replies during setup as the original one.
+
+    Usage:
+    >>> socket = WeeChatReplaySocket("session.cap")
+    >>> client = WeeChatClient(socket=socket)
+    >>> while not socket.finished:
+    ...     socket.poll()
+    """
+
+    def __init__(self, path: str, realtime: bool = False, skip_unhandled_events: bool = True):
+        """
+        :param path: capture file to replay
+        :param realtime: deliver messages at the recorded pace instead of as fast as possible
+        :param skip_unhandled_events: see WeeChatSocket
+        """
+        self.replay = WeeChatReplay(path)
+        self.socket = _WeeChatReplayStream(self.replay, realtime)
+        self._init_state(None, 1, skip_unhandled_events, None)
+
+    @property
+    def finished(self) -> bool:
+        """
+        :return: True if all recorded messages were delivered
+        """
+        return self.socket.finished and not self._inbox
+
+    def wait(self, id: str = None):
+        """
+        Waits for the next recorded response
+        :param id: see WeeChatSocket.wait
+        :return: WeeChatMessage
+        """
+        while True:
+            ret = self.poll()
+            if ret is not None and (id is None or ret.id == id):
+                return ret
+            if self.finished:
+                raise EOFError("end of capture reached")
@@ -1,8 +1,34 @@
 from .socket import WeeChatSocket
 from .buffer import WeeChatBuffer
+from .hdata import WeeChatHdataQuery
+from .cache import WeeChatCache
 from datetime import datetime, timedelta
+from threading import Thread, RLock
 from pprint import pprint
 
+# Kinds of cached replies which may be outdated after an event. An empty tuple drops all cached replies
+_CACHE_INVALIDATION = {
+    "buffer_opened": ("hdata", "infolist"),
+    "buffer_type_changed": ("hdata", "infolist"),
+    "buffer_moved": ("hdata", "infolist"),
+    "buffer_merged": ("hdata", "infolist"),
+    "buffer_unmerged": ("hdata", "infolist"),
+    "buffer_hidden": ("hdata", "infolist"),
+    "buffer_unhidden": ("hdata", "infolist"),
+    "buffer_renamed": ("hdata", "infolist"),
+    "buffer_title_changed": ("hdata", "infolist"),
+    "buffer_localvar_added": ("hdata", "infolist"),
+    "buffer_localvar_changed": ("hdata", "infolist"),
+    "buffer_localvar_removed": ("hdata", "infolist"),
+    "buffer_closing": ("hdata", "infolist"),
+    "buffer_cleared": ("hdata",),
+    "buffer_line_added": ("hdata",),
+    "nicklist": ("info", "infolist", "hdata"),
+    "nicklist_diff": ("info", "infolist", "hdata"),
+    "upgrade": (),
+    "upgrade_ended": (),
+}
+
 
 class WeeChatClient:
     """
@@ -18,15 +44,42 @@ class WeeChatClient:
         :param custom_cert
         :param password
         :param compressed
+        :param input_rate: maximum number of input commands sent per second
+        :param input_burst: number of input commands which may be sent at once
+        :param skip_unhandled_events: do not parse events the client does not handle. Defaults to True
+        :param bootstrap_connections: number of additional connections used to request buffers in parallel
+            during setup. 0 to request all buffers over the main connection
+        :param cache_size: maximum number of cached info, infolist and hdata replies
+        :param cache_ttl: seconds a cached reply stays valid
+        :param recorder: WeeChatRecorder to write all messages received on the main connection to
+        :param socket: already connected WeeChatSocket (e.g. WeeChatReplaySocket) to use instead of connecting
         """
-        self.socket = WeeChatSocket(kwargs.get("hostname", "localhost"), kwargs.get("port", 8000),
-                                    kwargs.get("use_ssl", False), kwargs.get("custom_cert", None),
-                                    kwargs.get("custom_ssl_protocol", None))
-        self.socket.connect(kwargs.get("password"), kwargs.get("compressed", True))
+        self._options = kwargs
+        self.cache = WeeChatCache(kwargs.get("cache_size", 256), kwargs.get("cache_ttl", 60.0))
+        # serializes requests and polling on self.socket. Cache lookups are made while holding it, so a thread
+        # never waits for a cached request of another thread while blocking that thread's socket access
+        self._lock = RLock()
+        self.socket = kwargs.get("socket")
+        if self.socket is None:
+            self.socket = self._open_socket(kwargs.get("input_rate", None), kwargs.get("input_burst", 1),
+                                            kwargs.get("skip_unhandled_events", True), kwargs.get("recorder"))
 
         self.buffers = []
         self._setup()
 
+    def _open_socket(self, input_rate: float = None, input_burst: int = 1,
+                     skip_unhandled_events: bool = False, recorder=None) -> WeeChatSocket:
+        """
+        Open and initialize a new connection to the relay server this client is connected to
+        :return: WeeChatSocket
+        """
+        socket = WeeChatSocket(self._options.get("hostname", "localhost"), self._options.get("port", 8000),
+                               self._options.get("use_ssl", False), self._options.get("custom_cert", None),
+                               self._options.get("custom_ssl_protocol", None), input_rate, input_burst,
+                               skip_unhandled_events, recorder)
+        socket.connect(self._options.get("password"), self._options.get("compressed", True))
+        return socket
+
     def get_buffer_by_pointer(self, pointer: str) -> WeeChatBuffer:
         """
         Search for a buffer with a given pointer
@@ -71,23 +124,38 @@ class WeeChatClient:
                 return buffer
         return None
 
+    def iter_history(self, buffer: WeeChatBuffer, before: str = None, page_size: int = 100):
+        """
+        Fetch older lines of a buffer on demand, newest line first.
+        Lines are fetched page by page and are not kept in memory.
+        :param buffer: WeeChatBuffer to read the history of
+        :param before: pointer of a line. Only older lines are returned. None to start at the newest line
+        :param page_size: number of lines to request per round trip
+        :return: generator of line dicts
+        """
+        return WeeChatBuffer.iter_history(self.socket, buffer.pointer, before, page_size, self._lock)
+
     def _setup(self):
         """
         Requests data from all buffers
         :return:
         """
 
-        last = "gui_buffers"
-        while True:
-            buf, raw = WeeChatBuffer.from_pointer(self.socket, last)
+        connections = self._options.get("bootstrap_connections", 0)
+        if connections > 0:
+            self._setup_parallel(connections)
+        else:
+            last = "gui_buffers"
+            while True:
+                buf, raw = WeeChatBuffer.from_pointer(self.socket, last)
 
-            if buf:
-                self.buffers.append(buf)
-            if raw:
-                if raw.get("next_buffer") is not None and raw.get("next_buffer") != "0":
-                    last = raw.get("next_buffer")
-                else:
-                    break
+                if buf:
+                    self.buffers.append(buf)
+                if raw:
+                    if raw.get("next_buffer") is not None and raw.get("next_buffer") != "0":
+                        last = raw.get("next_buffer")
+                    else:
+                        break
 
         # Setup event handling only after reading buffers completed
         self.socket.on("buffer_opened", self._on_buffer_opened)
@@ -97,7 +165,7 @@ class WeeChatClient:
         self.socket.on("buffer_unmerged", None)  # NIY
         self.socket.on("buffer_hidden", None)  # NIY
         self.socket.on("buffer_unhidden", None)  # NIY
-        self.socket.on("buffer_remaned", self._on_buffer_renamed)
+        self.socket.on("buffer_renamed", self._on_buffer_renamed)
         self.socket.on("buffer_title_changed", self._on_buffer_title_changed)
         self.socket.on("buffer_localvar_added", None)  # NIY
         self.socket.on("buffer_localvar_changed", None)  # NIY
@@ -109,9 +177,59 @@ class WeeChatClient:
         self.socket.on("pong", None)  # NIY
         self.socket.on("upgrade", None)  # NIY
         self.socket.on("upgrade_ended", None)  # NIY
+        self.socket.event_listener = self._invalidate_cache
 
         self.sync("*")
 
+    def _invalidate_cache(self, event: str):
+        """
+        Drop cached replies which may be outdated after an event
+        :param event: name of the received event
+        """
+        kinds = _CACHE_INVALIDATION.get(event)
+        if kinds is not None:
+            self.cache.invalidate(*kinds)
+
+    def _setup_parallel(self, connections: int):
+        """
+        Requests data from all buffers using additional short lived connections.
+        The buffer list is split between the connections, which are queried concurrently.
+        :param connections: number of additional connections to open
+        """
+        resp = WeeChatHdataQuery.prepare("buffer", "", ("number",)).fetch(self.socket, "gui_buffers", "*")
+        pointers = [buffer["__path"][0] for buffer in resp]
+        connections = min(connections, len(pointers))
+        if not connections:
+            return
+
+        buffers = {}
+        errors = []
+
+        def fetch(shard):
+            try:
+                socket = self._open_socket()
+                socket.blocking_wait = True  # sleep in select instead of competing for the GIL
+                try:
+                    for pointer in shard:
+                        result = WeeChatBuffer.from_pointer(socket, pointer)
+                        if result and result[0]:
+                            buffers[pointer] = result[0]
+                finally:
+                    socket.disconnect()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=fetch, args=(pointers[i::connections],)) for i in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        # keep the buffer order of the relay
+        self.buffers.extend(buffers[pointer] for pointer in pointers if pointer in buffers)
+
     def _on_buffer_opened(self, response: dict):
         self.buffers.append(WeeChatBuffer(response))
 
@@ -153,10 +271,15 @@ class WeeChatClient:
             self.buffers.remove(buffer)
 
     def _on_nicklist(self, message: dict):
-        buffer = self.get_buffer_by_pointer(message.get("__path")[0])
-        if buffer:
-            buffer.nicklist = []
-            for nick in message:
+        if isinstance(message, dict):
+            message = [message]
+        cleared = set()
+        for nick in message:
+            buffer = self.get_buffer_by_pointer(nick.get("__path")[0])
+            if buffer:
+                if buffer.pointer not in cleared:
+                    buffer.nicklist = []
+                    cleared.add(buffer.pointer)
                 buffer.add_nick(nick)
 
     def _on_nicklist_diff(self, message: dict):
@@ -168,7 +291,8 @@ class WeeChatClient:
         :param channel: Buffer to get updates for
         :return:
         """
-        self.socket.send_async("sync " + channel)
+        with self._lock:
+            self.socket.send_async("sync " + channel)
 
     def desync(self, channel: str):
         """
@@ -176,16 +300,68 @@ class WeeChatClient:
         :param channel: Buffer to get updates for
         :return:
         """
-        self.socket.send_async("desync " + channel)
+        with self._lock:
+            self.socket.send_async("desync " + channel)
+
+    def info(self, name: str, arguments: str = None) -> str:
+        """
+        Request an info. The reply is cached
+        :param name: name of the info
+        :param arguments: optional arguments of the info
+        :return: value of the info
+        """
+        request = "info " + name
+        if arguments:
+            request += " " + arguments
+        with self._lock:
+            return self.cache.get(("info", request), lambda: self._request(request).result[0][1])
+
+    def infolist(self, name: str, pointer: str = None, arguments: str = None) -> list:
+        """
+        Request an infolist. The reply is cached and must not be modified
+        :param name: name of the infolist
+        :param pointer: optional pointer to restrict the infolist to
+        :param arguments: optional arguments of the infolist
+        :return: list of dict
+        """
+        request = "infolist " + name
+        if pointer or arguments:
+            request += " " + (pointer or "0")
+        if arguments:
+            request += " " + arguments
+        with self._lock:
+            return self.cache.get(("infolist", request), lambda: self._request(request).result[0][1])
+
+    def hdata(self, query: WeeChatHdataQuery, pointer: str, count=None) -> list:
+        """
+        Request a hdata. The reply is cached and must not be modified
+        :param query: query to send
+        :param pointer: see WeeChatHdataQuery.request
+        :param count: see WeeChatHdataQuery.request
+        :return: list of dict
+        """
+        with self._lock:
+            return self.cache.get(("hdata", query.request(pointer, count)),
+                                  lambda: query.fetch(self.socket, pointer, count))
+
+    def _request(self, request: str):
+        """
+        Send a request and wait for its reply
+        :param request: request to send
+        :return: WeeChatMessage
+        """
+        with self._lock:
+            return self.socket.send(request)
 
-    def input(self, buffer: str, message: str) -> dict:
+    def input(self, buffer: str, message: str) -> None:
         """
         Send a messag to the server
+        The relay does not reply to input, so this does not wait for a response
         :param buffer: buffer name to send the message from
         :param message: message to send
-        :return: Response
         """
-        return self.socket.send("input {} {}".format(buffer, message)).get_hdata_result()
+        with self._lock:
+            self.socket.send_async("input {} {}".format(buffer, message))
 
     def run(self, periodic_callback=None, delta: timedelta = None):
         """
@@ -201,7 +377,8 @@ class WeeChatClient:
                     now = datetime.now()
                     if not periodic_callback():
                         break
-            self.socket.poll()
+            with self._lock:
+                self.socket.poll()
 
     def print(self):
         for buffer in self.buffers:
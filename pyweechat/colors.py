@@ -0,0 +1,123 @@
+import re
+
+# See https://weechat.org/files/doc/devel/weechat_relay_protocol.en.html#colors
+_ATTRIBUTES = {
+    "*": "bold",
+    "!": "reverse",
+    "/": "italic",
+    "_": "underline",
+    "%": "blink",
+    ".": "dim",
+}
+_A = r"[*!/_|%.]"
+_COLOR = r"(?:\d{2}|@\d{5})"
+# foreground color with attributes: (A)STD or @(A)EXT
+_FG = r"(" + _A + r"*\d{2}|@" + _A + r"*\d{5})"
+
+_CODE = re.compile(
+    "\x19(?:"
+    r"b[FDB_\-#il]"  # bar codes
+    r"|E"  # emphasis
+    r"|(\x1c)"  # reset colors
+    r"|F" + _FG +  # foreground
+    r"|B(" + _COLOR + ")"  # background
+    r"|\*" + _FG + "(?:[,~](" + _COLOR + "))?"  # foreground and background
+    r"|(\d{2})"  # color of a weechat option
+    r"|(@\d{5})"  # extended color
+    r")?"
+    "|\x1a(" + _A + ")"  # set attribute
+    "|\x1b(" + _A + ")"  # remove attribute
+    "|(\x1c)"  # reset colors and attributes
+)
+
+
+def strip_colors(message: str) -> str:
+    """
+    Remove all color and attribute codes of a message
+    :param message: message as received from weechat
+    :return: plain text
+    """
+    return _CODE.sub("", message)
+
+
+def strip_colors_bulk(messages: list) -> list:
+    """
+    Remove all color and attribute codes of many messages at once
+    :param messages: list of messages as received from weechat
+    :return: list of plain text
+    """
+    joined = "\n".join(messages)
+    if joined.count("\n") != len(messages) - 1:  # messages contain the separator
+        return [strip_colors(message) for message in messages]
+    return _CODE.sub("", joined).split("\n") if messages else []
+
+
+def decode_colors(message: str) -> list:
+    """
+    Split a message into spans of equal style.
+    Colors are returned as sent by weechat: two digits for a weechat color, "@" and five digits for an extended
+    color, "option:" and two digits for the color of a weechat color option.
+    :param message: message as received from weechat
+    :return: list of dict with the keys text, fg, bg and attributes (set of bold, reverse, italic, underline, ...)
+    """
+    spans = []
+    fg = bg = None
+    attributes = set()
+    start = 0
+
+    for match in _CODE.finditer(message):
+        if match.start() > start:
+            spans.append({"text": message[start:match.start()], "fg": fg, "bg": bg, "attributes": set(attributes)})
+        start = match.end()
+
+        reset_colors, f_color, b_color, fb_fg, fb_bg, option, extended, set_attr, remove_attr, reset = \
+            match.groups()
+        if reset:
+            fg = bg = None
+            attributes = set()
+        elif reset_colors:
+            fg = bg = None
+        elif f_color:
+            f_attr, fg = _split_color(f_color)
+            attributes = _apply_attributes(attributes, f_attr)
+        elif b_color:
+            bg = b_color
+        elif fb_fg:
+            fb_attr, fg = _split_color(fb_fg)
+            bg = fb_bg or bg
+            attributes = _apply_attributes(attributes, fb_attr)
+        elif option:
+            fg = "option:" + option
+        elif extended:
+            fg = extended
+        elif set_attr and set_attr in _ATTRIBUTES:
+            attributes.add(_ATTRIBUTES[set_attr])
+        elif remove_attr and remove_attr in _ATTRIBUTES:
+            attributes.discard(_ATTRIBUTES[remove_attr])
+
+    if start < len(message):
+        spans.append({"text": message[start:], "fg": fg, "bg": bg, "attributes": set(attributes)})
+    return spans
+
+
+def _split_color(color: str) -> tuple:
+    """
+    Split a foreground color into its attributes and the color itself
+    :param color: (A)STD or @(A)EXT
+    :return: tuple(attributes, color)
+    """
+    if color.startswith("@"):
+        return color[1:-5], "@" + color[-5:]
+    return color[:-2], color[-2:]
+
+
+def _apply_attributes(attributes: set, codes: str) -> set:
+    """
+    Apply the attributes given along with a color. Previous attributes are kept only if codes contains "|"
+    """
+    if "|" in codes:
+        attributes = set(attributes)
+    else:
+        attributes = set()
+    attributes.update(_ATTRIBUTES[code] for code in codes if code in _ATTRIBUTES)
+    return attributes
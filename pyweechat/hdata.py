@@ -0,0 +1,102 @@
+from .socket import WeeChatSocket
+
+
+class WeeChatHdataQuery:
+    """
+    Prepared hdata request.
+    The request string is assembled once, only the pointer (and count) is filled in per request.
+
+    Usage:
+    >>> query = WeeChatHdataQuery("buffer").var("lines").var("first_line", "*").var("data").select("message", "date")
+    >>> query.request("gui_buffers")
+    'hdata buffer:gui_buffers/lines/first_line(*)/data message,date'
+    >>> lines = WeeChatHdataQuery.prepare("buffer", "lines/first_line(*)/data", ("message", "date")).fetch(socket, "0x1234")
+    """
+    _prepared = {}
+
+    def __init__(self, hdata: str, path: tuple = (), keys: tuple = ()):
+        """
+        :param hdata: name of the hdata to start at (buffer, line, ...)
+        :param path: tuple of (variable, count) pairs to follow. count is None, "*" or a (negative) number
+        :param keys: keys to return. Empty to return all keys
+        """
+        self.hdata = hdata
+        self.path = tuple(path)
+        self.keys = tuple(keys)
+
+        suffix = ""
+        for var, count in self.path:
+            suffix += "/" + var
+            if count is not None:
+                suffix += "(" + str(count) + ")"
+        if self.keys:
+            suffix += " " + ",".join(self.keys)
+        self._prefix = "hdata " + hdata + ":"
+        self._suffix = suffix
+
+    def var(self, name: str, count=None):
+        """
+        Follow a variable of the current hdata
+        :param name: name of the variable
+        :param count: number of elements to follow. None for a single one, "*" for all
+        :return: WeeChatHdataQuery
+        """
+        return WeeChatHdataQuery(self.hdata, self.path + ((name, count),), self.keys)
+
+    def select(self, *keys):
+        """
+        Only return the given keys instead of all available
+        :param keys: key names
+        :return: WeeChatHdataQuery
+        """
+        return WeeChatHdataQuery(self.hdata, self.path, keys)
+
+    def request(self, pointer: str, count=None) -> str:
+        """
+        Build the request string for a pointer
+        :param pointer: pointer (0x...) or name of a hdata list (gui_buffers, ...)
+        :param count: number of elements to read starting at pointer. None for a single one
+        :return: str
+        """
+        if count is not None:
+            pointer += "(" + str(count) + ")"
+        return self._prefix + pointer + self._suffix
+
+    def fetch(self, socket: WeeChatSocket, pointer: str, count=None) -> list:
+        """
+        Send the request and wait for its result
+        :param socket: socket to send the request over
+        :param pointer: see request
+        :param count: see request
+        :return: list of dict. Empty if there is no result
+        """
+        result = socket.send(self.request(pointer, count)).get_hdata_result()
+        if not result:
+            return []
+        if isinstance(result, dict):
+            return [result]
+        return result
+
+    @classmethod
+    def prepare(cls, hdata: str, path: str = "", keys: tuple = ()):
+        """
+        Get a cached query for a hdata path. At most 256 queries are kept
+        :param hdata: name of the hdata to start at
+        :param path: variables to follow, separated by "/". Counts are given in brackets: "lines/first_line(*)/data"
+        :param keys: keys to return. Empty to return all keys
+        :return: WeeChatHdataQuery
+        """
+        keys = tuple(keys)
+        query = cls._prepared.get((hdata, path, keys))
+        if query is None:
+            vars = []
+            for var in path.split("/") if path else []:
+                count = None
+                if var.endswith(")"):
+                    var, count = var[:-1].split("(")
+                vars.append((var, count))
+            query = cls(hdata, vars, keys)
+            if len(cls._prepared) >= 256:
+                cls._prepared.clear()
+            cls._prepared[(hdata, path, keys)] = query
+        return query
@@ -5,6 +5,8 @@ class WeeChatMessage:
     """
     Response data of the weechat relay server
     """
+    _hdata_keys = {}
+
     def __init__(self, data, debug=False):
         """
         Parse the response data from a weechat relay server
@@ -17,6 +19,7 @@ class WeeChatMessage:
         >>> response = WeeChatMessage(data).result
         >>> main_hadata = WeeChatMessage(data).get_hdata_result()
         """
+        self.raw = data
         self.data = data
         self.length = 0
         self.compression = False
@@ -41,6 +44,26 @@ class WeeChatMessage:
         except KeyError:
             self.result = None
 
+    @staticmethod
+    def peek_id(data) -> str:
+        """
+        Read only the id of a complete message without parsing its body.
+        Compressed messages are only decompressed as far as the id.
+        :param data: a single complete message, including its length header
+        :return: str
+        """
+        data = memoryview(data)
+        if data[4:5] != b"\x00":
+            decompressor = zlib.decompressobj()
+            length = int.from_bytes(decompressor.decompress(data[5:], 4), "big")
+            if length == 0 or length == 0xffffffff:
+                return ""
+            return decompressor.decompress(decompressor.unconsumed_tail, length).decode()
+        length = int.from_bytes(data[5:9], "big")
+        if length == 0 or length == 0xffffffff:
+            return ""
+        return bytes(data[9:9 + length]).decode()
+
     def get_hdata_result(self) -> dict:
         """
         Return only the main hdata block.
@@ -205,16 +228,22 @@ class WeeChatMessage:
         """
         self._log("begin hdata")
         hpath = self._read_string()
-        if not hpath:
-            return None
+        if not hpath:  # empty hdata, still carries (empty) keys and count
+            self._read_string()
+            self._read_int()
+            return hpath, [], []
         path_length = len(hpath.split("/"))
         keys = self._read_string()
-        keys = keys.split(",")
-        _keys = []
-        for key in keys:
-            _key = key.split(":")
-            self._log("hdata: key", _key)
-            _keys.append((_key[0], _key[1]))
+        _keys = self._hdata_keys.get(keys)
+        if _keys is None:  # replies to the same request share their keys, parse them only once
+            _keys = []
+            for key in keys.split(","):
+                _key = key.split(":")
+                self._log("hdata: key", _key)
+                _keys.append((_key[0], _key[1]))
+            if len(self._hdata_keys) >= 256:
+                self._hdata_keys.clear()
+            self._hdata_keys[keys] = _keys
 
         count = self._read_int()
         path = []
@@ -246,19 +275,19 @@ class WeeChatMessage:
         """
         Read list of info objects
         See https://weechat.org/files/doc/devel/weechat_relay_protocol.en.html#object_infolist
-        :return: list(tuple(str,str))
+        :return: tuple(str, list(dict))
         """
         name = self._read_string()
         count = self._read_int()
-        items = {}
+        items = []
         for i in range(count):
             i_count = self._read_int()
-            i_name = self._read_string()
-            i_type = self._read_type()
-            i_items = []
+            item = {}
             for j in range(i_count):
-                i_items.append(self._read_value(i_type))
-            items[i_name] = i_items
+                i_name = self._read_string()
+                i_type = self._read_type()
+                item[i_name] = self._read_value(i_type)
+            items.append(item)
         self._log("type:", name, items)
         return name, items
 
@@ -0,0 +1,376 @@
+import re
+import ssl
+import zlib
+import socket
+import select
+import struct
+from .client import WeeChatClient
+
+
+def _pack_int(value: int) -> bytes:
+    return struct.pack(">i", value)
+
+
+def _pack_chr(value: int) -> bytes:
+    return struct.pack(">B", value)
+
+
+def _pack_str(value: str) -> bytes:
+    if value is None:
+        return struct.pack(">I", 0xffffffff)
+    data = value.encode()
+    return struct.pack(">I", len(data)) + data
+
+
+def _pack_ptr(value: str) -> bytes:
+    data = (value or "0").encode()
+    return struct.pack(">B", len(data)) + data
+
+
+_PACK = {
+    "int": _pack_int,
+    "chr": _pack_chr,
+    "str": _pack_str,
+    "ptr": _pack_ptr,
+}
+
+
+def _pack_hdata(hpath: str, keys: list, items: list) -> bytes:
+    """
+    Encode a hdata object
+    See https://weechat.org/files/doc/devel/weechat_relay_protocol.en.html#object_hdata
+    :param hpath: hdata path (buffer, buffer/nicklist_item, ...)
+    :param keys: list of (name, type)
+    :param items: list of (pointers, values) where values is a list in the order of keys
+    :return: bytes
+    """
+    data = b"hda" + _pack_str(hpath) + _pack_str(",".join(name + ":" + type for name, type in keys))
+    data += _pack_int(len(items))
+    for pointers, values in items:
+        for pointer in pointers:
+            data += _pack_ptr(pointer)
+        for (name, type), value in zip(keys, values):
+            data += _PACK[type](value)
+    return data
+
+
+def _frame(id: str, body: bytes) -> bytes:
+    """
+    Build an uncompressed message
+    :param id: message id
+    :param body: encoded objects
+    :return: bytes
+    """
+    data = _pack_str(id) + body
+    return struct.pack(">I", len(data) + 5) + b"\x00" + data
+
+
+def _uncompressed(frame: bytes) -> bytes:
+    """
+    Decompress a message if needed
+    :param frame: complete message, possibly compressed
+    :return: uncompressed message
+    """
+    if frame[4:5] == b"\x00":
+        return frame
+    data = zlib.decompress(frame[5:])
+    return struct.pack(">I", len(data) + 5) + b"\x00" + data
+
+
+def _body(frame: bytes) -> bytes:
+    """
+    Strip length, compression and id of a message
+    :param frame: complete message, possibly compressed
+    :return: uncompressed encoded objects
+    """
+    data = frame[5:]
+    if frame[4:5] != b"\x00":
+        data = zlib.decompress(data)
+    length = struct.unpack(">I", data[:4])[0]
+    if length == 0xffffffff:
+        length = 0
+    return data[4 + length:]
+
+
+# Buffer attributes which are answered from the client state, with their hdata type
+_BUFFER_KEYS = {
+    "number": "int",
+    "name": "str",
+    "full_name": "str",
+    "short_name": "str",
+    "title": "str",
+}
+
+
+class _WeeChatProxyConnection:
+    """
+    A client connected to WeeChatProxy
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.socket = sock
+        self.socket.setblocking(0)
+        self.initialized = False
+        self.closed = False
+        self.sync_all = False
+        self.synced = set()
+        self._inbox = bytearray()
+        self._outbox = bytearray()
+
+    def read(self) -> list:
+        """
+        Read available data
+        :return: list of complete received command lines
+        """
+        try:
+            data = self.socket.recv(65536)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return []
+        except socket.error:
+            data = b""
+        if not data:
+            self.closed = True
+            return []
+        self._inbox += data
+        *lines, rest = self._inbox.split(b"\n")
+        self._inbox = bytearray(rest)
+        return [line.decode(errors="replace").strip() for line in lines if line.strip()]
+
+    def send(self, frame: bytes) -> None:
+        self._outbox += frame
+
+    def flush(self) -> None:
+        """
+        Write as much queued data as the socket accepts without blocking
+        """
+        while self._outbox and not self.closed:
+            try:
+                sent = self.socket.send(self._outbox)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except socket.error:
+                self.closed = True
+                break
+            del self._outbox[:sent]
+
+    def subscribed(self, names: set) -> bool:
+        """
+        :param names: pointers and names identifying a buffer. Empty if the message belongs to no buffer
+        :return: True if the client synced the buffer
+        """
+        if self.sync_all:
+            return True
+        if not names:
+            return bool(self.synced)
+        return not self.synced.isdisjoint(names)
+
+    def close(self) -> None:
+        self.closed = True
+        self.socket.close()
+
+
+class WeeChatProxy:
+    """
+    Serves the weechat relay protocol to local clients over a single upstream connection.
+    Buffer lists are answered from the state of the WeeChatClient, other requests (including nicklists, which the
+    client does not keep complete) are forwarded. Their replies are kept in the cache of the client, identical
+    requests of several clients are forwarded only once.
+    Events are only sent to clients which synced the buffer they belong to.
+    All messages to local clients are sent uncompressed.
+
+    Usage:
+    >>> proxy = WeeChatProxy(WeeChatClient(hostname="example.com", port=8000), port=9000)
+    >>> proxy.run()
+    """
+
+    def __init__(self, client: WeeChatClient, hostname: str = "localhost", port: int = 8001, password: str = None):
+        """
+        :param client: client connected to the upstream relay
+        :param hostname: address to listen on for local clients
+        :param port: port to listen on for local clients
+        :param password: password local clients have to send on init. None to accept all clients
+        """
+        self.client = client
+        # every event has to be parsed to fan it out
+        self.client.socket.skip_unhandled_events = False
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((hostname, port))
+        self.server.listen(16)
+        self.server.setblocking(0)
+
+        self.password = password
+        self.connections = []
+        # upstream request id -> (cache key, cache generation when forwarded)
+        self._forwarded = {}
+        # cache key -> list of (connection, id) waiting for the reply
+        self._inflight = {}
+        self._next_id = 0
+
+    def poll(self, timeout: float = 0) -> None:
+        """
+        Accept new clients, handle their requests and pass on messages from the upstream relay
+        :param timeout: seconds to wait for activity
+        """
+        sockets = [self.server, self.client.socket.socket] + [connection.socket for connection in self.connections]
+        readable = select.select(sockets, [], [], timeout)[0]
+
+        if self.server in readable:
+            try:
+                sock, address = self.server.accept()
+                self.connections.append(_WeeChatProxyConnection(sock))
+            except BlockingIOError:
+                pass
+
+        for connection in self.connections:
+            if connection.socket in readable:
+                for line in connection.read():
+                    self._handle(connection, line)
+
+        with self.client._lock:
+            while True:
+                message = self.client.socket.poll()
+                if message is None:
+                    break
+                self._dispatch(message)
+
+        for connection in self.connections:
+            connection.flush()
+            if connection.closed:
+                connection.socket.close()
+        self.connections = [connection for connection in self.connections if not connection.closed]
+
+    def run(self) -> None:
+        """
+        Serve local clients until interrupted
+        """
+        while True:
+            self.poll(0.05)
+
+    def close(self) -> None:
+        """
+        Disconnect all local clients and stop listening
+        """
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.server.close()
+
+    def _handle(self, connection: _WeeChatProxyConnection, line: str) -> None:
+        """
+        Handle a single command of a local client
+        """
+        id = ""
+        if line.startswith("("):
+            id, _, line = line[1:].partition(")")
+            line = line.strip()
+        command, _, arguments = line.partition(" ")
+        arguments = arguments.strip()
+
+        if command == "handshake":
+            connection.send(_frame(id, b"htbstrstr" + _pack_int(3) +
+                                   _pack_str("password_hash_algo") + _pack_str("plain") +
+                                   _pack_str("totp") + _pack_str("off") +
+                                   _pack_str("compression") + _pack_str("off")))
+        elif command == "init":
+            options = dict(option.partition("=")[::2] for option in re.split(r"[,\s]+", arguments) if option)
+            if self.password is not None and options.get("password") != self.password:
+                connection.closed = True
+                return
+            connection.initialized = True
+        elif not connection.initialized or command == "quit":
+            connection.closed = True
+        elif command == "ping":
+            connection.send(_frame("_pong", b"str" + _pack_str(arguments)))
+        elif command == "sync":
+            self._sync(connection, arguments, True)
+        elif command == "desync":
+            self._sync(connection, arguments, False)
+        elif command == "input":
+            with self.client._lock:
+                self.client.socket.send_async(line)
+        elif command in ("hdata", "info", "infolist", "nicklist"):
+            body = self._buffer_list(arguments) if command == "hdata" else None
+            # nicklists are invalidated along with hdata
+            key = ("hdata" if command == "nicklist" else command, "proxy", line)
+            if body is None:
+                body = self.client.cache.peek(key)
+            if body is not None:
+                connection.send(_frame(id, body))
+                return
+            if key in self._inflight:  # already forwarded for another client
+                self._inflight[key].append((connection, id))
+                return
+            self._inflight[key] = [(connection, id)]
+            upstream_id = "proxy_{}".format(self._next_id)
+            self._next_id += 1
+            self._forwarded[upstream_id] = (key, self.client.cache.generation)
+            with self.client._lock:  # the client may be used by other threads
+                self.client.socket.send_async("(" + upstream_id + ") " + line)
+
+    def _sync(self, connection: _WeeChatProxyConnection, arguments: str, sync: bool) -> None:
+        """
+        Update the buffers a local client receives events for
+        """
+        buffers = arguments.split(" ")[0]
+        if not buffers or buffers == "*":
+            connection.sync_all = sync
+            if not sync:
+                connection.synced.clear()
+            return
+        for name in buffers.split(","):
+            if sync:
+                connection.synced.add(name)
+            else:
+                connection.synced.discard(name)
+
+    def _buffer_list(self, arguments: str) -> bytes:
+        """
+        Encode the buffer list if a hdata request can be answered from the client state
+        :return: encoded hdata or None if the request has to be forwarded
+        """
+        path, _, keys = arguments.partition(" ")
+        if path != "buffer:gui_buffers(*)" or not keys:
+            return None
+        keys = keys.split(",")
+        if any(key not in _BUFFER_KEYS for key in keys):
+            return None
+        return _pack_hdata("buffer", [(key, _BUFFER_KEYS[key]) for key in keys],
+                           [([buffer.pointer], [getattr(buffer, key) for key in keys])
+                            for buffer in self.client.buffers])
+
+    def _dispatch(self, message) -> None:
+        """
+        Pass a message of the upstream relay on to the local clients it is meant for
+        """
+        if message.id in self._forwarded:
+            key, generation = self._forwarded.pop(message.id)
+            body = _body(message.raw)
+            self.client.cache.put(key, body, generation)
+            for connection, id in self._inflight.pop(key):
+                if not connection.closed:
+                    connection.send(_frame(id, body))
+            return
+
+        if not message.id.startswith("_") or message.id == "_pong":
+            return  # reply to a request of the client itself
+
+        names = set()
+        result = message.result[0] if message.result else None
+        if isinstance(result, tuple) and len(result) == 3:  # hdata
+            for item in result[2]:
+                pointer = item.get("buffer", item["__path"][0])
+                names.update(("0x" + pointer, pointer))
+                if item.get("full_name"):
+                    names.add(item.get("full_name"))
+                buffer = self.client.get_buffer_by_pointer(pointer)
+                if buffer:
+                    names.add(buffer.full_name)
+
+        frame = None
+        for connection in self.connections:
+            if connection.initialized and connection.subscribed(names):
+                if frame is None:  # local clients were told compression is off
+                    frame = _uncompressed(message.raw)
+                connection.send(frame)
@@ -1,5 +1,8 @@
 import ssl
+import time
 import socket
+import select
+from collections import deque
 from .exceptions import WeeChatUnknownCommandException
 from .message import WeeChatMessage
 import sys
@@ -14,13 +17,43 @@ def create_ssl_context(protocol_version=None):
     return ssl.SSLContext(ssl.PROTOCOL_TLSv1)
 
 
+class TokenBucket:
+    """
+    Simple token bucket used to rate limit outgoing commands
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: tokens refilled per second
+        :param burst: maximum number of tokens which can be saved up
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def consume(self) -> bool:
+        """
+        Take a single token from the bucket
+        :return: True if a token was available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
 class WeeChatSocket:
     """
     Socket to interact with the weechat relay server.
     """
 
     def __init__(self, hostname: str = "localhost", port: int = 8000, use_ssl: bool = False, custom_cert: dict = None,
-                 custom_ssl_protocol=None):
+                 custom_ssl_protocol=None, input_rate: float = None, input_burst: int = 1,
+                 skip_unhandled_events: bool = False, recorder=None):
         """
         Setup socket which is used to connect to the Weechat relay
         :param hostname: hostname or ip address of the desired weechat relay server
@@ -43,6 +76,30 @@ class WeeChatSocket:
             self.socket = context.wrap_socket(self.socket, server_hostname=hostname)
         self.socket.connect((hostname, port))
         self.socket.setblocking(0)
+        self._init_state(input_rate, input_burst, skip_unhandled_events, recorder)
+
+    def _init_state(self, input_rate: float, input_burst: int, skip_unhandled_events: bool, recorder) -> None:
+        """
+        Setup queues and event handling. Does not touch self.socket
+        """
+        # Commands are queued and written out in as few syscalls as possible. _outbox holds bytes ready to be
+        # written (possibly the remainder of a partial write), _pending holds commands held back by rate limits
+        self._outbox = bytearray()
+        self._pending = deque()
+        self._input_limit = TokenBucket(input_rate, input_burst) if input_rate else None
+
+        # Received data which does not yet form a complete message
+        self._inbox = bytearray()
+        self.skip_unhandled_events = skip_unhandled_events
+        self.recorder = recorder
+        # called with the name of every received event before it is parsed, whether it has a callback or not
+        self.event_listener = None
+        # counter for the ids of requests sent by send()
+        self._request_id = 0
+        # replies to requests of send() which are still awaited, received while waiting for another (nested) reply
+        self._replies = {}
+        # let wait() sleep until the socket is readable instead of polling continuously
+        self.blocking_wait = False
 
         self.events = {
             "buffer_opened": None,
@@ -52,7 +109,7 @@ class WeeChatSocket:
             "buffer_unmerged": None,
             "buffer_hidden": None,
             "buffer_unhidden": None,
-            "buffer_remaned": None,
+            "buffer_renamed": None,
             "buffer_title_changed": None,
             "buffer_localvar_added": None,
             "buffer_localvar_changed": None,
@@ -79,18 +136,53 @@ class WeeChatSocket:
         if compressed is False:
             conection += b" compression=off"
         conection += b"\r\n"
-        self.socket.sendall(conection)
+        self._pending.append((None, conection))
+        self.flush()
 
     def send_async(self, data: str) -> None:
         """
         Send data to the weechat relay. Do not await response
-        :param data: Data to send. First word must be a valid weechat relay command
+        Data is only queued. It is written, together with other queued commands, by the next poll, wait or flush
+        :param data: Data to send. First word must be a valid weechat relay command, optionally preceded by a
+            request id in brackets which is used as id of the response
         """
         if data:
-            command = data.strip().split()[0].strip()
+            words = data.strip().split()
+            if words[0].startswith("("):
+                words = words[1:]
+            command = words[0] if words else ""
             if command not in ["ping", "hdata", "info", "infolist", "nicklist", "input", "sync", "desync", "quit"]:
                 raise WeeChatUnknownCommandException(command)
-            self.socket.sendall(data.encode() + b"\r\n")
+            self._pending.append((command, data.encode() + b"\r\n"))
+
+    def flush(self) -> bool:
+        """
+        Write as much queued data as the socket accepts without blocking.
+        Queued commands are coalesced into a single write. Input commands exceeding the input rate limit
+        stay queued, as do all commands after them to preserve ordering.
+        :return: True if all queued data was written
+        """
+        while self._pending:
+            command, data = self._pending[0]
+            if command == "input" and self._input_limit and not self._input_limit.consume():
+                break
+            self._pending.popleft()
+            self._outbox += data
+
+        while self._outbox:
+            try:
+                sent = self.socket.send(self._outbox)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            del self._outbox[:sent]
+
+        return not self._outbox and not self._pending
+
+    def pending(self) -> bool:
+        """
+        :return: True if there is queued data which has not been written yet
+        """
+        return bool(self._outbox or self._pending)
 
     def poll(self) -> WeeChatMessage:
         """
@@ -98,13 +190,33 @@ class WeeChatSocket:
         Must be called within the relay servers socket timeout period
         :return: WeeChatMessage or None if error or nothing new
         """
+        self.flush()
         try:
-            response = self.socket.recv(4096 * 1024)
+            data = self.socket.recv(4096 * 1024)
         except socket.error:
-            return None
+            data = None
+        if data:
+            self._inbox += data
+
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return None
+            if self.recorder is not None:
+                self.recorder.record(frame)
+
+            if self.skip_unhandled_events or self.event_listener is not None:
+                id = WeeChatMessage.peek_id(frame)
+                if id[:1] == "_":
+                    id = id[1:]
+                if self.event_listener is not None and id in self.events.keys():
+                    self.event_listener(id)
+            if self.skip_unhandled_events:
+                # _pong is the reply to ping, which wait() may be waiting for
+                if id in self.events.keys() and self.events[id] is None and id != "pong":
+                    continue
 
-        if response:
-            response = WeeChatMessage(response)
+            response = WeeChatMessage(frame)
             if response.id:
                 id = response.id
                 if id[0] == "_":
@@ -112,7 +224,20 @@ class WeeChatSocket:
                 if id in self.events.keys() and self.events[id] is not None:
                     self.events[id](response.get_hdata_result())
             return response
-        return None
+
+    def _next_frame(self) -> bytes:
+        """
+        Take a single complete message from the received data
+        :return: bytes or None if no complete message was received yet
+        """
+        if len(self._inbox) < 4:
+            return None
+        length = int.from_bytes(self._inbox[:4], "big")
+        if len(self._inbox) < length:
+            return None
+        frame = bytes(self._inbox[:length])
+        del self._inbox[:length]
+        return frame
 
     def on(self, event: str, callback: callable = None) -> None:
         """
@@ -126,25 +251,66 @@ class WeeChatSocket:
     def disconnect(self) -> None:
         """
         Gracefully end connection with weechat relay
+        Queued commands are written out before quitting, ignoring the input rate limit
         """
-        self.socket.sendall(b"quit\r\n")
+        self.socket.setblocking(1)
+        for command, data in self._pending:
+            self._outbox += data
+        self._pending.clear()
+        self._outbox += b"quit\r\n"
+        self.socket.sendall(self._outbox)
+        self._outbox.clear()
         self.socket.close()
 
-    def wait(self) -> WeeChatMessage:
+    def wait(self, id: str = None) -> WeeChatMessage:
         """
-        Waits for a response from relay server. Does not block interpreter thread, but has higher processor usage
+        Waits for a response from relay server. Does not block interpreter thread, but has higher processor usage,
+        unless blocking_wait is set
+        :param id: id of the awaited response. Other messages are handled by poll and discarded, except replies
+            to other requests of send() still awaited. None to return the next message
         :return: WeeChatMessage
         """
         while True:
+            if self._replies.get(id) is not None:  # received by a nested wait
+                return self._replies.pop(id)
             ret = self.poll()
-            if ret is not None:
+            if ret is not None and (id is None or ret.id == id):
+                self._replies.pop(ret.id, None)
                 return ret
+            if ret is not None and ret.id in self._replies:
+                # e.g. the reply to an outer request while a callback waits for its own request
+                self._replies[ret.id] = ret
+            if self.blocking_wait and not self._replies.get(id):
+                self._wait_readable()
+
+    def _wait_readable(self, timeout: float = 0.1) -> None:
+        """
+        Sleep until new data can be read from the relay server, queued data can be written or timeout passed
+        """
+        if isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+            return  # already decrypted data is not visible to select
+        if len(self._inbox) >= 4 and len(self._inbox) >= int.from_bytes(self._inbox[:4], "big"):
+            return  # complete message not yet handled
+        select.select([self.socket], [self.socket] if self._outbox else [], [], timeout)
 
     def send(self, data: str) -> WeeChatMessage:
         """
         Send data to the weechat relay, wait for response
+        Requests are sent with a request id (unless data already has one), so events received in the meantime are
+        not mistaken for the response
         :param data: data to send to the relay. First word must be a valid weechat relay command
         :return: WeeChatMessage
         """
+        words = data.strip().split()
+        id = None
+        if words and words[0].startswith("(") and words[0].endswith(")"):
+            id = words[0][1:-1]
+        elif words and words[0] in ["hdata", "info", "infolist", "nicklist"]:
+            id = "pyweechat_{}".format(self._request_id)
+            self._request_id += 1
+            self._replies[id] = None
+            data = "(" + id + ") " + data
+        elif words and words[0] == "ping":
+            id = "_pong"
         self.send_async(data)
-        return self.wait()
+        return self.wait(id)